@@ -1,11 +1,83 @@
 import os
+import re
+import ast
 import sys
+import time
 import argparse
 import shutil
 import subprocess
+import io
+import gzip
+import lzma
+import json
+import array
+import queue
+import bisect
+import hashlib
+import tarfile
+import zipfile
+import itertools
+import threading
+import collections
+import functools
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Форматы выходного файла: расширение -> (контейнер, сжатие)
+OUTPUT_FORMATS = {
+    'md': ('md', None),
+    'md.gz': ('md', 'gz'),
+    'md.xz': ('md', 'xz'),
+    'md.zst': ('md', 'zst'),
+    'tar': ('tar', None),
+    'tar.gz': ('tar', 'gz'),
+    'tar.xz': ('tar', 'xz'),
+    'tar.zst': ('tar', 'zst'),
+    'zip': ('zip', None),
+}
+
+# Имя файла-манифеста внутри tar/zip архива
+MANIFEST_NAME = 'MANIFEST.json'
+
+# Файлов в одной порции работы процесса-обработчика при чтении нескольких корней
+WORKER_CHUNK_SIZE = 32
+
+# Соответствие расширений файлов типам блоков кода markdown
+FILE_TYPE_MAPPING = {
+    '.cpp': 'cpp',
+    '.cxx': 'cpp',
+    '.c++': 'cpp',
+    '.cc': 'cpp',
+    '.mm': 'cpp',
+    '.c': 'c',
+    '.h': 'c',
+    '.hh': 'c',
+    '.hpp': 'cpp',
+    '.qml': 'js',
+    '.txt': 'text',
+    '.diff': 'diff',
+    '.md': 'markdown',
+    '.py': 'python',
+    '.sh': 'bash',
+    '.yml': 'yaml',
+    '.yaml': 'yaml',
+    '.json': 'json',
+    '.xml': 'xml',
+    '.ini': 'ini',
+    '.cfg': 'ini',
+    '.toml': 'toml',
+    '.sql': 'sql',
+    '.cmake': 'cmake',
+    '': 'text',
+}
+
 
 def is_text_file(file_path):
     """
@@ -109,55 +181,48 @@ def select_template(templates):
         return None
 
 
-def apply_template(template_path, generated_content):
+def split_template(template_path):
     """
-    Применяет шаблон к сгенерированному содержимому.
-    Заменяет плейсхолдер [{{
-    }}] в шаблоне на сгенерированное содержимое.
-    Исправлено: использование простой конкатенации для избежания лишних символов.
+    Разбивает шаблон по плейсхолдеру [{{
+    }}] на две части: текст до сгенерированного содержимого и после него.
+    Возвращает кортеж (head, tail). Если плейсхолдер не найден, tail равен None,
+    а head содержит шаблон целиком. При ошибке чтения возвращает ('', ''),
+    то есть содержимое сохраняется без шаблона.
     """
     try:
         with open(template_path, 'r', encoding='utf-8') as f:
             template_content = f.read()
 
         # Ищем плейсхолдер для замены - [{{
-        # }}] (с переносами строк как в предоставленном примере)
-        placeholder = "[{{\n}}]"
-
-        if placeholder in template_content:
-            # Используем конкатенацию вместо f-строки с двойными фигурными скобками
-            # Это избегает проблемы с экранированием и появлением лишних символов \
-            replacement_content = "[{{\n" + generated_content + "\n}}]"
-            result_content = template_content.replace(placeholder, replacement_content)
-            print(f"Шаблон '{template_path.name}' успешно применен")
-            return result_content
-        else:
-            # Также проверяем альтернативный вариант плейсхолдера
-            alt_placeholder = "[{{\n\n}}]"
-            if alt_placeholder in template_content:
-                replacement_content = "[{{\n" + generated_content + "\n}}]"
-                result_content = template_content.replace(alt_placeholder, replacement_content)
-                print(f"Шаблон '{template_path.name}' успешно применен")
-                return result_content
+        # }}] (с переносами строк как в предоставленном примере),
+        # а также альтернативный вариант с пустой строкой внутри
+        found_placeholder = None
+        for placeholder in ("[{{\n}}]", "[{{\n\n}}]"):
+            if placeholder in template_content:
+                found_placeholder = placeholder
+                break
 
+        if found_placeholder is None:
             # Если не нашли точный плейсхолдер, попробуем более гибкий поиск
-            import re
             # Ищем любой вариант [{{...}}] с возможными пробелами и переносами строк
             pattern = r'\[\{\{[\s\n]*\}\}\]'
             match = re.search(pattern, template_content)
             if match:
                 found_placeholder = match.group(0)
-                replacement_content = "[{{\n" + generated_content + "\n}}]"
-                result_content = template_content.replace(found_placeholder, replacement_content)
-                print(f"Шаблон '{template_path.name}' успешно применен")
-                return result_content
 
+        if found_placeholder is None:
             print(f"Внимание: шаблон '{template_path.name}' не содержит ожидаемого плейсхолдера [{{\n}}]")
             print("Содержимое шаблона будет использовано как есть")
-            return template_content
+            return template_content, None
+
+        # Используем конкатенацию вместо f-строки с двойными фигурными скобками
+        # Это избегает проблемы с экранированием и появлением лишних символов \
+        before, _, after = template_content.partition(found_placeholder)
+        print(f"Шаблон '{template_path.name}' успешно применен")
+        return before + "[{{\n", "\n}}]" + after
     except Exception as e:
         print(f"Ошибка при чтении шаблона {template_path}: {e}")
-        return generated_content
+        return '', ''
 
 
 class TreeNode:
@@ -280,6 +345,14 @@ class TreeNode:
                 selected_files.extend(child.get_selected_files())
         return selected_files
 
+    def iter_file_nodes(self):
+        """Рекурсивный обход всех файлов поддерева"""
+        if self.type == 'file':
+            yield self
+        else:
+            for child in self.children:
+                yield from child.iter_file_nodes()
+
     def collect_extensions(self):
         """Сбор уникальных расширений в каталоге и подкаталогах (только текстовые файлы)"""
         extensions_set = set()
@@ -303,86 +376,212 @@ class TreeNode:
             return False
 
 
+def build_root_node(root_path, default_extensions):
+    """
+    Рекурсивное построение дерева начиная с корневой директории (только текстовые файлы).
+    Функция уровня модуля, чтобы корни можно было сканировать в отдельных процессах.
+    """
+    root_path = Path(root_path)
+
+    def build_node(current_path, parent=None):
+        # Определяем имя узла
+        if parent is None:
+            node_name = root_path.name
+        else:
+            node_name = current_path.name
+
+        node_type = 'directory' if current_path.is_dir() else 'file'
+        node = TreeNode(node_name, current_path, node_type, parent)
+
+        if node_type == 'directory' and 'build' not in str(current_path.relative_to(root_path)):
+            try:
+                # Сначала собираем всех потенциальных детей
+                potential_children = []
+                for item in sorted(current_path.iterdir()):
+                    if item.name.startswith('.'):
+                        continue
+                    if item.is_dir() and 'build' in str(item.relative_to(root_path)):
+                        continue
+                    potential_children.append(item)
+
+                # Рекурсивно строим детей
+                for item in potential_children:
+                    child = build_node(item, node)
+                    if child is not None:
+                        # Для файлов проверяем, текстовые ли они
+                        if child.type == 'file':
+                            if is_text_file(child.path):
+                                node.add_child(child)
+                            else:
+                                continue
+                        else:
+                            if child.has_text_files():
+                                node.add_child(child)
+                            else:
+                                continue
+            except PermissionError:
+                pass
+
+        # Устанавливаем состояние по умолчанию для текстовых файлов в корневом каталоге
+        if parent is None and node.type == 'directory':
+            for child in node.children:
+                if child.type == 'file':
+                    ext = child.path.suffix.lower()
+                    if ext in default_extensions or (ext == '' and '' in default_extensions):
+                        child.selected = True
+
+        # Собираем расширения для каталогов (только если есть дети)
+        if node.type == 'directory' and node.children:
+            extensions = sorted(list(node.collect_extensions()))
+            if extensions:
+                node.extensions = [(i+1, ext) for i, ext in enumerate(extensions)]
+
+        # Возвращаем узел только если он файл или каталог с текстовыми файлами
+        if node.type == 'file':
+            return node
+        elif node.type == 'directory':
+            if parent is None or node.children:
+                return node
+            else:
+                return None
+        else:
+            return node
+
+    return build_node(root_path)
+
+
 class FileTree:
     """Класс для построения и управления деревом файловой системы"""
-    def __init__(self, root_path, default_extensions):
-        self.root_path = Path(root_path)
+    def __init__(self, root_paths, default_extensions, include_paths=(), use_search_index=False):
+        # Допускается один корень или список корней
+        if isinstance(root_paths, (str, os.PathLike)):
+            root_paths = [root_paths]
+        self.root_paths = [Path(root_path) for root_path in root_paths]
+        self.root_path = self.root_paths[0]
         self.default_extensions = default_extensions
+        self.include_paths = list(include_paths)
         self.root = None
         self.line_to_node = {}
+        self.dependency_graph = None
+        self.use_search_index = use_search_index
+        self.search_index = None
+        self.path_to_node = None
         self.build_tree()
 
     def build_tree(self):
-        """Рекурсивное построение дерева начиная с корневой директории (только текстовые файлы)"""
-        def build_node(current_path, parent=None):
-            # Определяем имя узла
-            if parent is None:
-                node_name = self.root_path.name
-            else:
-                node_name = current_path.name
+        """
+        Построение дерева. Для нескольких корней каждый сканируется в отдельном
+        процессе, а результаты объединяются в виртуальный корень с поддеревом на каждый корень.
+        """
+        if len(self.root_paths) == 1:
+            self.root = build_root_node(self.root_path, self.default_extensions)
+            if self.root is None:
+                print("В указанной директории нет текстовых файлов.")
+                sys.exit(0)
+            return
 
-            node_type = 'directory' if current_path.is_dir() else 'file'
-            node = TreeNode(node_name, current_path, node_type, parent)
+        max_workers = min(len(self.root_paths), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            subtrees = list(executor.map(build_root_node, self.root_paths,
+                                         [self.default_extensions] * len(self.root_paths)))
 
-            if node_type == 'directory' and 'build' not in str(current_path.relative_to(self.root_path)):
-                try:
-                    # Сначала собираем всех потенциальных детей
-                    potential_children = []
-                    for item in sorted(current_path.iterdir()):
-                        if item.name.startswith('.'):
-                            continue
-                        if item.is_dir() and 'build' in str(item.relative_to(self.root_path)):
-                            continue
-                        potential_children.append(item)
-
-                    # Рекурсивно строим детей
-                    for item in potential_children:
-                        child = build_node(item, node)
-                        if child is not None:
-                            # Для файлов проверяем, текстовые ли они
-                            if child.type == 'file':
-                                if is_text_file(child.path):
-                                    node.add_child(child)
-                                else:
-                                    continue
-                            else:
-                                if child.has_text_files():
-                                    node.add_child(child)
-                                else:
-                                    continue
-                except PermissionError:
-                    pass
-
-            # Устанавливаем состояние по умолчанию для текстовых файлов в корневом каталоге
-            if parent is None and node.type == 'directory':
-                for child in node.children:
-                    if child.type == 'file':
-                        ext = child.path.suffix.lower()
-                        if ext in self.default_extensions or (ext == '' and '' in self.default_extensions):
-                            child.selected = True
-
-            # Собираем расширения для каталогов (только если есть дети)
-            if node.type == 'directory' and node.children:
-                extensions = sorted(list(node.collect_extensions()))
-                if extensions:
-                    node.extensions = [(i+1, ext) for i, ext in enumerate(extensions)]
-
-            # Возвращаем узел только если он файл или каталог с текстовыми файлами
-            if node.type == 'file':
-                return node
-            elif node.type == 'directory':
-                if parent is None or node.children:
-                    return node
-                else:
-                    return None
-            else:
-                return node
+        labels = get_root_labels(self.root_paths)
+        self.root = TreeNode(" + ".join(labels), None, 'directory')
+        for root_path, label, subtree in zip(self.root_paths, labels, subtrees):
+            if subtree is None or not subtree.children:
+                print(f"В каталоге '{root_path}' нет текстовых файлов, он пропущен.")
+                continue
+            subtree.name = label
+            subtree.parent = self.root
+            self.root.add_child(subtree)
 
-        self.root = build_node(self.root_path)
-        if self.root is None:
-            print("В указанной директории нет текстовых файлов.")
+        if not self.root.children:
+            print("В указанных директориях нет текстовых файлов.")
             sys.exit(0)
 
+        extensions = sorted(list(self.root.collect_extensions()))
+        self.root.extensions = [(i+1, ext) for i, ext in enumerate(extensions)]
+
+    def get_selected_file_groups(self):
+        """
+        Возвращает список пар (корень, выбранные файлы) для каждого корня дерева.
+        Файл из пересекающихся корней попадает только в первую группу.
+        """
+        if len(self.root_paths) == 1:
+            return [(self.root_path, self.root.get_selected_files())]
+
+        file_groups = []
+        seen = set()
+        for subtree in self.root.children:
+            files = []
+            for file_path in subtree.get_selected_files():
+                key = file_path.resolve()
+                if key not in seen:
+                    seen.add(key)
+                    files.append(file_path)
+            file_groups.append((subtree.path, files))
+        return file_groups
+
+    def get_path_to_node(self):
+        """Отображение абсолютного пути файла на узел дерева (строится один раз)."""
+        if self.path_to_node is None:
+            self.path_to_node = {str(node.path.resolve()): node for node in self.root.iter_file_nodes()}
+        return self.path_to_node
+
+    def get_dependency_graph(self):
+        """Граф зависимостей по всем файлам дерева (строится один раз за сеанс)."""
+        if self.dependency_graph is None:
+            print("Построение графа зависимостей...")
+            self.dependency_graph = DependencyGraph(self.root_paths, self.include_paths)
+            self.dependency_graph.build(self.get_path_to_node())
+        return self.dependency_graph
+
+    def select_dependency_closure(self, file_paths):
+        """Выделяет файлы и все их транзитивные зависимости #include/import, найденные в дереве."""
+        path_to_node = self.get_path_to_node()
+        closure = self.get_dependency_graph().closure(file_paths)
+        requested = {str(Path(file_path).resolve()) for file_path in file_paths}
+
+        selected_count = 0
+        outside_count = 0
+        for key in closure:
+            node = path_to_node.get(key)
+            if node is not None:
+                node.selected = True
+                selected_count += 1
+            elif key not in requested:
+                outside_count += 1
+
+        print(f"Выделено файлов с зависимостями: {selected_count}")
+        if outside_count:
+            print(f"Зависимостей вне дерева (не выделены): {outside_count}")
+
+    def find_files_containing(self, text):
+        """
+        Возвращает узлы текстовых файлов дерева, содержащих строку text.
+        С включенным индексом проверяются только файлы-кандидаты по триграммам.
+        """
+        path_to_node = self.get_path_to_node()
+        pattern = text.encode('utf-8')
+
+        candidates = list(path_to_node)
+        if self.use_search_index:
+            if self.search_index is None:
+                self.search_index = SearchIndex(self.root_paths)
+            self.search_index.update(candidates)
+            indexed = self.search_index.candidates(pattern)
+            if indexed is not None:
+                candidates = [key for key in candidates if key in indexed]
+
+        return [path_to_node[key] for key in grep_files(candidates, pattern)]
+
+    def select_matching_files(self, text):
+        """Выделяет все файлы дерева, содержащие строку text."""
+        matches = self.find_files_containing(text)
+        for node in matches:
+            node.selected = True
+        print(f"Найдено файлов, содержащих '{text}': {len(matches)}")
+
     def print_tree(self):
         """Вывод дерева с нумерацией строк и выравниванием расширений по табуляции"""
         self.line_to_node = {}
@@ -451,6 +650,27 @@ class FileTree:
         commands = user_input.strip().split()
 
         for cmd in commands:
+            # 0. Специальные команды
+            # Поиск по содержимому: выделение файлов, содержащих текст
+            if cmd.startswith('/'):
+                if len(cmd) > 1:
+                    self.select_matching_files(cmd[1:])
+                else:
+                    print(f"Неверный формат команды: {cmd}")
+                continue
+
+            # Выделение файла (или всех файлов каталога) вместе с зависимостями
+            if cmd.startswith('@'):
+                try:
+                    line_num = int(cmd[1:])
+                except ValueError:
+                    print(f"Неверный формат команды: {cmd}")
+                    continue
+                if line_num in self.line_to_node:
+                    node = self.line_to_node[line_num]
+                    self.select_dependency_closure([file_node.path for file_node in node.iter_file_nodes()])
+                continue
+
             # 1. Сначала проверяем команды с префиксом + или -
             if cmd.startswith('+') or cmd.startswith('-'):
                 prefix = cmd[0]
@@ -573,41 +793,584 @@ def should_process_file(file_path, allowed_extensions):
 
 def get_file_type(extension):
     """Определяет тип файла для форматирования в markdown."""
-    type_mapping = {
-        '.cpp': 'cpp',
-        '.cxx': 'cpp',
-        '.c++': 'cpp',
-        '.cc': 'cpp',
-        '.mm': 'cpp',
-        '.c': 'c',
-        '.h': 'c',
-        '.hh': 'c',
-        '.hpp': 'cpp',
-        '.qml': 'js',
-        '.txt': 'text',
-        '.diff': 'diff',
-        '.md': 'markdown',
-        '.py': 'python',
-        '.sh': 'bash',
-        '.yml': 'yaml',
-        '.yaml': 'yaml',
-        '.json': 'json',
-        '.xml': 'xml',
-        '.ini': 'ini',
-        '.cfg': 'ini',
-        '.toml': 'toml',
-        '.sql': 'sql',
-        '.cmake': 'cmake',
-        '': 'text',
-    }
     if extension == 'CMAKELISTS.TXT':
         return 'cmake'
-    return type_mapping.get(extension.lower(), 'text')
+    return FILE_TYPE_MAPPING.get(extension.lower(), 'text')
+
+
+# Расширения C/C++ файлов, в которых разбираются директивы #include
+C_FAMILY_EXTENSIONS = {ext for ext, file_type in FILE_TYPE_MAPPING.items() if file_type in ('c', 'cpp')}
+
+# Расширения файлов, в которых разбираются директивы import
+IMPORT_EXTENSIONS = {'.py', '.qml'}
+
+INCLUDE_PATTERN = re.compile(r'^[ \t]*#[ \t]*include[ \t]*([<"])([^">]+)[">]', re.MULTILINE)
+QML_IMPORT_PATTERN = re.compile(r'^[ \t]*import[ \t]+(?:"([^"]+)"|([A-Za-z_][\w.]*))', re.MULTILINE)
+
+
+def get_cache_dir():
+    """Возвращает каталог для кэшей скрипта ($XDG_CACHE_HOME/analise или ~/.cache/analise)."""
+    cache_root = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    cache_dir = Path(cache_root) / 'analise'
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
 
+def get_roots_cache_key(root_paths):
+    """Короткий ключ для набора корней, используемый в именах файлов кэша."""
+    roots = "\n".join(sorted(str(Path(root_path).resolve()) for root_path in root_paths))
+    return hashlib.sha1(roots.encode('utf-8')).hexdigest()[:16]
 
-def generate_output_filename(base_directory_path, num_parent_dirs):
-    """Генерирует имя файла в формате parent1-parent2-...-basename_timestamp.md"""
-    path_parts = list(Path(base_directory_path).parts)
+
+def parse_dependencies(file_path, content):
+    """
+    Извлекает из содержимого файла ссылки на зависимости.
+    Возвращает список пар (вид, ссылка):
+    'quote'/'angle' - #include "..." и #include <...> для C/C++,
+    'python' - модуль из import/from ... import (с точками для относительного импорта),
+    'qml-path'/'qml-module' - import "..." и import Module для QML.
+    """
+    suffix = Path(file_path).suffix.lower()
+    dependencies = []
+
+    if suffix in C_FAMILY_EXTENSIONS:
+        for bracket, target in INCLUDE_PATTERN.findall(content):
+            dependencies.append(('quote' if bracket == '"' else 'angle', target.strip()))
+
+    elif suffix == '.py':
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            return dependencies
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    dependencies.append(('python', alias.name))
+            elif isinstance(node, ast.ImportFrom):
+                module = '.' * node.level + (node.module or '')
+                dependencies.append(('python', module))
+                # Имена из from X import Y могут оказаться подмодулями пакета X
+                for alias in node.names:
+                    if alias.name != '*':
+                        separator = '.' if node.module else ''
+                        dependencies.append(('python', module + separator + alias.name))
+
+    elif suffix == '.qml':
+        for path_import, module_import in QML_IMPORT_PATTERN.findall(content):
+            if path_import:
+                dependencies.append(('qml-path', path_import))
+            else:
+                dependencies.append(('qml-module', module_import))
+
+    return dependencies
+
+
+def scan_dependency_record(file_path, cached_sha256=None):
+    """
+    Читает файл и разбирает его зависимости (выполняется в процессе-обработчике).
+    Если хэш содержимого совпал с cached_sha256, разбор пропускается и
+    вместо списка зависимостей возвращается None.
+    """
+    try:
+        with open(file_path, 'rb') as source_file:
+            data = source_file.read()
+    except OSError:
+        return file_path, None, []
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    if sha256 == cached_sha256:
+        return file_path, sha256, None
+
+    content = data.decode('utf-8', errors='replace')
+    return file_path, sha256, parse_dependencies(file_path, content)
+
+
+class DependencyGraph:
+    """
+    Граф зависимостей #include/import между файлами.
+    Разобранные зависимости сохраняются в кэше вместе с хэшем содержимого,
+    поэтому при повторных запусках заново разбираются только измененные файлы.
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, root_paths, include_paths=()):
+        self.root_paths = [Path(root_path).resolve() for root_path in root_paths]
+        self.include_paths = [Path(include_path).resolve() for include_path in include_paths]
+        self.cache_path = get_cache_dir() / f"deps-{get_roots_cache_key(self.root_paths)}.json"
+        self.records = {}
+        self.edges = {}
+        self.load()
+
+    def load(self):
+        """Загружает кэш разобранных зависимостей, если он есть и совместим."""
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as cache_file:
+                cache = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+        if cache.get('version') == self.CACHE_VERSION:
+            self.records = cache.get('files', {})
+
+    def save(self):
+        """Сохраняет кэш разобранных зависимостей."""
+        cache = {'version': self.CACHE_VERSION, 'files': self.records}
+        temp_path = self.cache_path.with_name(f"{self.cache_path.stem}.{os.getpid()}.tmp")
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш зависимостей {self.cache_path}: {e}")
+
+    def build(self, files):
+        """
+        Обновляет граф для списка файлов. Файлы с неизменными mtime и размером
+        берутся из кэша, остальные читаются и разбираются параллельно в процессах.
+        """
+        self.report(self.update(files))
+
+    def report(self, updated_count):
+        """Сообщает об обновлении графа и сохраняет кэш, если что-то изменилось."""
+        if updated_count:
+            print(f"Граф зависимостей: обновлено файлов - {updated_count}, всего в кэше - {len(self.records)}")
+            self.save()
+
+    def update(self, files):
+        """
+        Разбирает новые и измененные файлы без сохранения кэша.
+        Возвращает количество обновленных записей.
+        """
+        stale = []
+        for file_path in files:
+            file_path = Path(file_path).resolve()
+            suffix = file_path.suffix.lower()
+            if suffix not in C_FAMILY_EXTENSIONS and suffix not in IMPORT_EXTENSIONS:
+                continue
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            key = str(file_path)
+            record = self.records.get(key)
+            if record and record['mtime_ns'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                continue
+            stale.append((key, stat))
+
+        if not stale:
+            return 0
+
+        paths = [key for key, _ in stale]
+        cached_hashes = [self.records.get(key, {}).get('sha256') for key in paths]
+        if len(stale) == 1:
+            results = [scan_dependency_record(paths[0], cached_hashes[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                chunksize = max(1, len(stale) // ((os.cpu_count() or 1) * 4))
+                results = list(executor.map(scan_dependency_record, paths, cached_hashes, chunksize=chunksize))
+
+        for (key, stat), (_, sha256, dependencies) in zip(stale, results):
+            if dependencies is None:
+                # Содержимое не изменилось, обновляем только mtime
+                dependencies = self.records[key]['deps']
+            self.records[key] = {
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha256': sha256,
+                'deps': [list(dependency) for dependency in dependencies],
+            }
+            self.edges.pop(key, None)
+
+        return len(stale)
+
+    def get_search_dirs(self, file_path):
+        """Каталоги поиска для относительных ссылок: каталог файла, пути поиска и корни."""
+        return [Path(file_path).parent] + self.include_paths + self.root_paths
+
+    def resolve_python_module(self, file_path, module):
+        """Находит файл модуля Python (module.py или module/__init__.py)."""
+        level = len(module) - len(module.lstrip('.'))
+        parts = [part for part in module[level:].split('.') if part]
+
+        if level:
+            base_dirs = [Path(file_path).parent.joinpath(*(['..'] * (level - 1))).resolve()]
+        else:
+            base_dirs = self.get_search_dirs(file_path)
+
+        for base_dir in base_dirs:
+            module_path = base_dir.joinpath(*parts)
+            for candidate in (module_path.with_name(module_path.name + '.py') if parts else None,
+                              module_path / '__init__.py'):
+                if candidate is not None and candidate.is_file():
+                    return [candidate]
+        return []
+
+    def resolve(self, file_path, kind, target):
+        """Возвращает список файлов, на которые указывает ссылка (вид, ссылка)."""
+        if kind == 'python':
+            return self.resolve_python_module(file_path, target)
+
+        if kind == 'quote':
+            search_dirs = self.get_search_dirs(file_path)
+        elif kind == 'angle':
+            # Системные заголовки ищутся только в явно заданных путях
+            search_dirs = self.include_paths
+        elif kind == 'qml-path':
+            search_dirs = [Path(file_path).parent]
+        else:
+            # Модуль QML: каталог Module/Sub в путях поиска
+            target = target.replace('.', os.sep)
+            search_dirs = self.include_paths + self.root_paths
+
+        for search_dir in search_dirs:
+            candidate = (search_dir / target).resolve()
+            if candidate.is_file():
+                return [candidate]
+            if kind.startswith('qml') and candidate.is_dir():
+                return sorted(candidate.glob('*.qml'))
+        return []
+
+    def get_dependencies(self, file_path):
+        """Разрешенные прямые зависимости уже разобранного файла (с запоминанием)."""
+        key = str(Path(file_path).resolve())
+        if key not in self.edges:
+            record = self.records.get(key)
+            resolved = []
+            if record:
+                for kind, target in record['deps']:
+                    for dependency in self.resolve(key, kind, target):
+                        if str(dependency) != key and str(dependency) not in resolved:
+                            resolved.append(str(dependency))
+            self.edges[key] = resolved
+        return self.edges[key]
+
+    def closure(self, file_paths):
+        """
+        Транзитивное замыкание зависимостей: сами файлы и все, что им нужно.
+        Обход идет по уровням; файлы вне графа (например, из путей поиска)
+        разбираются одним параллельным вызовом на уровень, кэш сохраняется в конце.
+        """
+        result = []
+        seen = set()
+        updated_count = 0
+        level = [str(Path(file_path).resolve()) for file_path in file_paths]
+        while level:
+            level = [key for key in dict.fromkeys(level) if key not in seen]
+            seen.update(level)
+            result.extend(level)
+
+            updated_count += self.update([key for key in level if key not in self.records])
+
+            next_level = []
+            for key in level:
+                next_level.extend(self.get_dependencies(key))
+            level = next_level
+
+        self.report(updated_count)
+        return result
+
+
+# Файлов на одну задачу процесса-обработчика при поиске и индексации
+SEARCH_CHUNK_SIZE = 64
+
+
+def file_contains(file_path, pattern):
+    """Проверяет, содержит ли файл строку pattern (bytes)."""
+    try:
+        with open(file_path, 'rb') as source_file:
+            return pattern in source_file.read()
+    except OSError:
+        return False
+
+
+def search_files_worker(file_paths, pattern):
+    """Возвращает файлы из file_paths, содержащие pattern (выполняется в процессе-обработчике)."""
+    return [file_path for file_path in file_paths if file_contains(file_path, pattern)]
+
+
+def iter_chunks(items, size):
+    """Разбивает список на части длиной не более size."""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def grep_files(file_paths, pattern):
+    """
+    Ищет строку pattern (bytes) в файлах и возвращает совпавшие в исходном порядке.
+    Большие списки файлов обрабатываются параллельно в процессах.
+    """
+    file_paths = [str(file_path) for file_path in file_paths]
+    if len(file_paths) <= SEARCH_CHUNK_SIZE:
+        return search_files_worker(file_paths, pattern)
+
+    chunks = list(iter_chunks(file_paths, SEARCH_CHUNK_SIZE))
+    with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        results = executor.map(search_files_worker, chunks, [pattern] * len(chunks))
+        return [file_path for result in results for file_path in result]
+
+
+def get_trigrams(data):
+    """Отсортированный массив уникальных триграмм содержимого, каждая закодирована числом b0<<16|b1<<8|b2."""
+    unique = set(zip(data, data[1:], data[2:]))
+    return array.array('I', sorted((b0 << 16) | (b1 << 8) | b2 for b0, b1, b2 in unique))
+
+
+def extract_trigrams_worker(file_paths):
+    """Возвращает триграммы для каждого файла (выполняется в процессе-обработчике)."""
+    result = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, 'rb') as source_file:
+                result.append(get_trigrams(source_file.read()))
+        except OSError:
+            result.append(array.array('I'))
+    return result
+
+
+def read_uint32_array(index_file, count):
+    """Читает из файла массив из count беззнаковых 32-битных чисел."""
+    values = array.array('I')
+    values.frombytes(index_file.read(count * values.itemsize))
+    if len(values) != count:
+        raise ValueError("Файл индекса обрезан")
+    return values
+
+
+def build_csr(lists):
+    """
+    Упаковывает последовательность массивов в пару (offsets, values):
+    элементы i-го массива - values[offsets[i]:offsets[i + 1]].
+    """
+    offsets = array.array('I', [0])
+    values = array.array('I')
+    for items in lists:
+        values.extend(items)
+        offsets.append(len(values))
+    return offsets, values
+
+
+class SearchIndex:
+    """
+    Постоянный триграммный индекс содержимого файлов.
+    Файлы нумеруются, для каждой триграммы хранится список номеров файлов, где она
+    встречается, а для каждого файла - список его триграмм (для удаления при
+    изменении). Списки хранятся плотными массивами uint32 (смещения + значения),
+    поэтому индекс загружается чтением нескольких блоков байт. Поиск проверяет
+    только файлы, содержащие все триграммы запроса. Индекс обновляется
+    инкрементально по mtime и размеру файлов.
+
+    Формат файла: строка JSON-заголовка (таблица файлов и размеры массивов),
+    затем массивы keys, offsets, ids (триграммы) и file_offsets, file_trigrams (файлы).
+    """
+    CACHE_VERSION = 2
+
+    def __init__(self, root_paths):
+        self.cache_path = get_cache_dir() / f"search-{get_roots_cache_key(root_paths)}.idx"
+        # Номер файла -> [путь, mtime_ns, размер] или None для освободившегося номера
+        self.files = []
+        # Триграммы: отсортированные ключи и номера файлов по смещениям
+        self.keys = array.array('I')
+        self.offsets = array.array('I', [0])
+        self.ids = array.array('I')
+        # Триграммы файлов читаются из кэша только при обновлении
+        self.file_trigrams = None
+        self.file_section = None
+        self.load()
+
+    def load(self):
+        """Загружает таблицу файлов и списки триграмм, если кэш есть и совместим."""
+        try:
+            with open(self.cache_path, 'rb') as index_file:
+                header = json.loads(index_file.readline())
+                if header.get('version') != self.CACHE_VERSION or header.get('byteorder') != sys.byteorder:
+                    return
+                keys = read_uint32_array(index_file, header['keys'])
+                offsets = read_uint32_array(index_file, header['keys'] + 1)
+                ids = read_uint32_array(index_file, header['ids'])
+                file_section = (index_file.tell(), header['file_trigrams'])
+        except (OSError, ValueError, KeyError):
+            return
+        self.files = header['files']
+        self.keys, self.offsets, self.ids = keys, offsets, ids
+        self.file_section = file_section
+
+    def load_file_trigrams(self):
+        """Читает из кэша списки триграмм по файлам (нужны только для обновления)."""
+        if self.file_trigrams is not None:
+            return self.file_trigrams
+        self.file_trigrams = [array.array('I') for _ in self.files]
+        if self.file_section is None:
+            return self.file_trigrams
+        position, count = self.file_section
+        try:
+            with open(self.cache_path, 'rb') as index_file:
+                index_file.seek(position)
+                file_offsets = read_uint32_array(index_file, len(self.files) + 1)
+                values = read_uint32_array(index_file, count)
+        except (OSError, ValueError):
+            # Без списков триграмм старые записи не удалить - строим индекс заново
+            print(f"Поисковый индекс {self.cache_path} поврежден и будет построен заново")
+            self.files = []
+            self.keys, self.offsets, self.ids = array.array('I'), array.array('I', [0]), array.array('I')
+            self.file_trigrams = []
+            return self.file_trigrams
+        self.file_trigrams = [values[file_offsets[i]:file_offsets[i + 1]] for i in range(len(self.files))]
+        return self.file_trigrams
+
+    def save(self):
+        """Сохраняет индекс в кэш."""
+        file_offsets, file_values = build_csr(self.file_trigrams)
+        header = {
+            'version': self.CACHE_VERSION,
+            'byteorder': sys.byteorder,
+            'files': self.files,
+            'keys': len(self.keys),
+            'ids': len(self.ids),
+            'file_trigrams': len(file_values),
+        }
+        temp_path = self.cache_path.with_name(f"{self.cache_path.stem}.{os.getpid()}.tmp")
+        try:
+            with open(temp_path, 'wb') as index_file:
+                index_file.write(json.dumps(header).encode('utf-8') + b'\n')
+                for values in (self.keys, self.offsets, self.ids):
+                    values.tofile(index_file)
+                position = index_file.tell()
+                file_offsets.tofile(index_file)
+                file_values.tofile(index_file)
+            os.replace(temp_path, self.cache_path)
+            self.file_section = (position + file_offsets.itemsize * len(file_offsets), len(file_values))
+        except OSError as e:
+            print(f"Не удалось сохранить поисковый индекс {self.cache_path}: {e}")
+
+    def update(self, file_paths):
+        """Переиндексирует новые и измененные файлы и удаляет исчезнувшие."""
+        current = {}
+        for file_path in file_paths:
+            key = os.path.abspath(file_path)
+            try:
+                stat = os.stat(key)
+            except OSError:
+                continue
+            current[key] = (stat.st_mtime_ns, stat.st_size)
+
+        indexed = {record[0]: (record[1], record[2]) for record in self.files if record is not None}
+        if indexed == current:
+            return
+
+        # Списки триграмм по файлам загружаем до разбора номеров файлов: если блок
+        # поврежден, таблица файлов сбрасывается и индекс строится заново
+        file_trigrams = self.load_file_trigrams()
+
+        path_to_id = {}
+        dropped = set()
+        stale = []
+        for file_id, record in enumerate(self.files):
+            if record is None:
+                continue
+            path, mtime_ns, size = record
+            signature = current.get(path)
+            if signature is None:
+                dropped.add(file_id)
+            elif signature != (mtime_ns, size):
+                dropped.add(file_id)
+                stale.append(path)
+            path_to_id[path] = file_id
+        removed_count = len(dropped) - len(stale)
+        stale.extend(path for path in current if path not in path_to_id)
+
+        # Распаковываем списки по триграммам для изменения
+        postings = {self.keys[i]: self.ids[self.offsets[i]:self.offsets[i + 1]] for i in range(len(self.keys))}
+
+        affected = set()
+        for file_id in dropped:
+            affected.update(file_trigrams[file_id])
+            file_trigrams[file_id] = array.array('I')
+            if self.files[file_id][0] not in current:
+                self.files[file_id] = None
+        for trigram in affected:
+            remaining = array.array('I', (file_id for file_id in postings[trigram] if file_id not in dropped))
+            if remaining:
+                postings[trigram] = remaining
+            else:
+                del postings[trigram]
+
+        chunks = list(iter_chunks(stale, SEARCH_CHUNK_SIZE))
+        if len(chunks) == 1:
+            results = [extract_trigrams_worker(chunks[0])]
+        else:
+            with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                results = executor.map(extract_trigrams_worker, chunks)
+
+        free_ids = [file_id for file_id, record in enumerate(self.files) if record is None]
+        for chunk, chunk_trigrams in zip(chunks, results):
+            for path, trigrams in zip(chunk, chunk_trigrams):
+                file_id = path_to_id.get(path)
+                if file_id is None:
+                    if free_ids:
+                        file_id = free_ids.pop()
+                    else:
+                        file_id = len(self.files)
+                        self.files.append(None)
+                        file_trigrams.append(array.array('I'))
+                self.files[file_id] = [path, *current[path]]
+                file_trigrams[file_id] = trigrams
+                for trigram in trigrams:
+                    file_ids = postings.get(trigram)
+                    if file_ids is None:
+                        postings[trigram] = array.array('I', [file_id])
+                    else:
+                        file_ids.append(file_id)
+
+        self.keys = array.array('I', sorted(postings))
+        self.offsets, self.ids = build_csr(postings[trigram] for trigram in self.keys)
+
+        print(f"Поисковый индекс: обновлено файлов - {len(stale)}, удалено - {removed_count}")
+        self.save()
+
+    def candidates(self, pattern):
+        """
+        Файлы, которые могут содержать pattern (bytes), или None,
+        если запрос короче триграммы и индекс не может сузить поиск.
+        """
+        trigrams = get_trigrams(pattern)
+        if not trigrams:
+            return None
+
+        postings = []
+        for trigram in trigrams:
+            i = bisect.bisect_left(self.keys, trigram)
+            if i == len(self.keys) or self.keys[i] != trigram:
+                return set()
+            postings.append(self.ids[self.offsets[i]:self.offsets[i + 1]])
+
+        # Начинаем пересечение с самых редких триграмм
+        postings.sort(key=len)
+        result = set(postings[0])
+        for file_ids in postings[1:]:
+            result.intersection_update(file_ids)
+            if not result:
+                break
+        return {self.files[file_id][0] for file_id in result}
+
+
+def generate_output_filename(base_directory_path, num_parent_dirs, extension='md'):
+    """
+    Генерирует имя файла в формате parent1-parent2-...-basename_timestamp.<extension>
+    Для списка каталогов префиксы отдельных корней объединяются через '+'.
+    """
+    if isinstance(base_directory_path, (list, tuple)):
+        base_directory_paths = base_directory_path
+    else:
+        base_directory_paths = [base_directory_path]
+
+    safe_prefix_cleaned = "+".join(get_directory_prefix(directory_path, num_parent_dirs)
+                                   for directory_path in base_directory_paths)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{safe_prefix_cleaned}_{timestamp}.{extension}"
+
+
+def get_directory_prefix(directory_path, num_parent_dirs):
+    """Безопасный префикс parent1-parent2-...-basename для имени файла или записи архива."""
+    path_parts = list(Path(directory_path).parts)
     basename_part = path_parts[-1]
 
     start_idx = max(0, len(path_parts) - 1 - num_parent_dirs)
@@ -615,111 +1378,618 @@ def generate_output_filename(base_directory_path, num_parent_dirs):
 
     prefix_parts = parent_parts + [basename_part]
     safe_prefix = "-".join(prefix_parts)
-    safe_prefix_cleaned = "".join(c for c in safe_prefix if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    return f"{safe_prefix_cleaned}_{timestamp}.md"
+    return "".join(c for c in safe_prefix if c.isalnum() or c in (' ', '-', '_', '.')).rstrip()
 
 
-def generate_markdown_content(files):
+def get_root_labels(root_paths, num_parent_dirs=0):
     """
-    Генерирует содержимое Markdown из списка файлов.
-    Возвращает строку с отформатированным содержимым.
+    Уникальные метки корней для дерева и имен записей архива: префикс
+    get_directory_prefix от абсолютного пути, совпадающие метки получают суффикс -2, -3, ...
     """
-    content_lines = []
+    labels = []
+    for root_path in root_paths:
+        base_label = get_directory_prefix(Path(root_path).resolve(), num_parent_dirs)
+        label = base_label
+        counter = 2
+        while label in labels:
+            label = f"{base_label}-{counter}"
+            counter += 1
+        labels.append(label)
+    return labels
+
+
+def get_markdown_file_type(file_path):
+    """Определяет тип блока кода markdown для файла с учетом CMakeLists.txt."""
+    if file_path.name.upper() == 'CMAKELISTS.TXT':
+        return 'cmake'
+    return get_file_type(file_path.suffix)
+
+
+def render_markdown_section(file_path, file_content):
+    """Формирует секцию Markdown одного файла: заголовок, блок кода и содержимое."""
+    file_type = get_markdown_file_type(file_path)
+
+    section_lines = [f"# {file_path}", f"```{file_type}", file_content]
+    if not file_content.endswith('\n'):
+        section_lines.append('')
+    section_lines.append("```")
+    section_lines.append("")
+    return "\n".join(section_lines)
 
+
+def iter_markdown_sections(files):
+    """
+    Генератор секций Markdown для списка файлов.
+    Каждая секция - заголовок, блок кода и содержимое одного файла.
+    Файлы с ошибками чтения пропускаются.
+    """
     for file_path in files:
         try:
             with open(file_path, 'r', encoding='utf-8') as source_file:
                 file_content = source_file.read()
 
-            if file_path.name.upper() == 'CMAKELISTS.TXT':
-                file_type = 'cmake'
-            else:
-                file_type = get_file_type(file_path.suffix)
+            section = render_markdown_section(file_path, file_content)
+            print(f"Обработан: {file_path}")
+            yield section
 
-            content_lines.append(f"# {file_path}")
-            content_lines.append(f"```{file_type}")
-            content_lines.append(file_content)
-            if not file_content.endswith('\n'):
-                content_lines.append('')
-            content_lines.append("```")
-            content_lines.append("")  # Пустая строка между файлами
+        except UnicodeDecodeError:
+            print(f"Пропущен: {file_path} (проблемы с кодировкой)")
+        except Exception as e:
+            print(f"Ошибка при обработке {file_path}: {e}")
 
-            print(f"Обработан: {file_path}")
+
+def iter_markdown_chunks(sections, template_path=None):
+    """
+    Генератор фрагментов итогового markdown-документа в UTF-8: начало шаблона,
+    секции файлов, разделенные пустой строкой, и окончание шаблона.
+    Секции вставляются на место плейсхолдера [{{
+    }}] и могут быть строками или уже закодированными байтами (из кэша).
+    """
+    head, tail = split_template(template_path) if template_path else ('', '')
+    if head:
+        yield head.encode('utf-8')
+    if tail is None:
+        return
+
+    first = True
+    for section in sections:
+        if not isinstance(section, bytes):
+            section = section.encode('utf-8')
+        yield section if first else b"\n" + section
+        first = False
+
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def call_as_list(func, items):
+    """Вызывает func(items) и возвращает результат списком (выполняется в процессе-обработчике)."""
+    return list(func(items))
+
+
+def iter_in_workers(func, items, chunk_size=WORKER_CHUNK_SIZE):
+    """
+    Генератор результатов func по items в исходном порядке. Элементы обрабатываются
+    порциями по chunk_size в процессах; в работе одновременно не больше двух порций
+    на процесс, поэтому результаты передаются потоком, а не накапливаются целиком.
+    Пул процессов создается при первой итерации, поэтому генератор нужно
+    итерировать из основного потока, а не из iter_in_background.
+    """
+    max_workers = os.cpu_count() or 1
+    chunks = iter_chunks(items, chunk_size)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = collections.deque(executor.submit(call_as_list, func, chunk)
+                                    for chunk in itertools.islice(chunks, max_workers * 2))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(call_as_list, func, chunk))
+            yield from results
+
+
+def iter_processed(func, items, parallel):
+    """
+    Генератор результатов func(items) в исходном порядке.
+    При parallel=True элементы обрабатываются в процессах (iter_in_workers),
+    иначе - в фоновом потоке текущего процесса (iter_in_background).
+    """
+    if parallel:
+        return iter_in_workers(func, items)
+    return iter_in_background(func(items))
+
+
+def iter_in_background(iterable, maxsize=16):
+    """
+    Выполняет итерацию по iterable в отдельном потоке и возвращает элементы
+    через ограниченную очередь. Пока потребитель сжимает и пишет очередной
+    фрагмент, поток-производитель уже читает следующие файлы.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if stop.is_set():
+                    return
+                items.put((item, None))
+        except BaseException as e:
+            items.put((done, e))
+        else:
+            items.put((done, None))
+
+    worker = threading.Thread(target=produce, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stop.set()
+        # Освобождаем место в очереди, чтобы производитель не завис на put()
+        while worker.is_alive():
+            try:
+                items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        worker.join()
+
+
+def open_compressed_output(output_file, compression):
+    """
+    Открывает выходной файл на запись в бинарном режиме с указанным сжатием.
+    compression: None, 'gz', 'xz' или 'zst'.
+    """
+    if compression is None:
+        return open(output_file, 'wb')
+    if compression == 'gz':
+        return gzip.open(output_file, 'wb')
+    if compression == 'xz':
+        return lzma.open(output_file, 'wb')
+    if compression == 'zst':
+        if zstandard is None:
+            raise RuntimeError("Для формата .zst необходим пакет 'zstandard' (pip install zstandard)")
+        return zstandard.ZstdCompressor().stream_writer(open(output_file, 'wb'), closefd=True)
+    raise ValueError(f"Неизвестный тип сжатия: {compression}")
+
+
+def get_archive_member_name(file_path, base_directory_path, label):
+    """Возвращает имя записи в архиве: метка корня плюс относительный путь файла."""
+    base = Path(base_directory_path).resolve()
+    try:
+        relative = Path(file_path).resolve().relative_to(base)
+    except ValueError:
+        relative = Path(file_path).name
+    return (Path(label) / relative).as_posix()
+
+
+def iter_archive_entries(items):
+    """
+    Генератор записей архива (имя, содержимое в байтах, описание для манифеста)
+    по парам (путь к файлу, имя записи). Файлы с ошибками чтения пропускаются.
+    """
+    for file_path, name in items:
+        try:
+            with open(file_path, 'rb') as source_file:
+                data = source_file.read()
+        except Exception as e:
+            print(f"Ошибка при обработке {file_path}: {e}")
+            continue
+
+        entry = {
+            'name': name,
+            'source': str(file_path),
+            'type': get_markdown_file_type(file_path),
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+        }
+        print(f"Обработан: {file_path}")
+        yield name, data, entry
+
+
+def get_section_name(file_path, content_sha256):
+    """Имя секции в кэше: хэш пути из заголовка, типа блока кода и содержимого файла."""
+    key = f"{file_path}\0{get_markdown_file_type(Path(file_path))}\0{content_sha256}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest() + '.md'
+
+
+def read_cached_section(sections_dir, name):
+    """Читает готовую секцию из кэша, возвращает None, если ее там нет."""
+    try:
+        with open(Path(sections_dir) / name, 'rb') as section_file:
+            return section_file.read()
+    except OSError:
+        return None
+
+
+def write_cached_section(sections_dir, name, section):
+    """Атомарно сохраняет секцию в кэш (безопасно при записи из нескольких процессов)."""
+    section_path = Path(sections_dir) / name
+    temp_path = section_path.with_name(f"{name}.{os.getpid()}.tmp")
+    try:
+        with open(temp_path, 'wb') as section_file:
+            section_file.write(section)
+        os.replace(temp_path, section_path)
+    except OSError as e:
+        print(f"Не удалось сохранить секцию в кэш {section_path}: {e}")
+
+
+def iter_cached_markdown_sections(items, sections_dir):
+    """
+    Генератор секций Markdown с использованием кэша секций по тройкам
+    (путь к файлу, ключ, запись кэша или None).
+    Возвращает тройки (секция в байтах, ключ, новая запись кэша).
+    Если mtime и размер файла не изменились, секция копируется из кэша без чтения
+    исходника; иначе по хэшу содержимого ищется готовая секция, и только
+    при ее отсутствии файл декодируется, форматируется и добавляется в кэш.
+    """
+    for file_path, key, entry in items:
+        try:
+            stat = os.stat(file_path)
+
+            if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                name = get_section_name(file_path, entry['sha256'])
+                section = read_cached_section(sections_dir, name)
+                if section is not None:
+                    print(f"Из кэша: {file_path}")
+                    yield section, key, dict(entry, name=name)
+                    continue
+
+            with open(file_path, 'rb') as source_file:
+                data = source_file.read()
+            sha256 = hashlib.sha256(data).hexdigest()
+            name = get_section_name(file_path, sha256)
+
+            section = read_cached_section(sections_dir, name)
+            if section is None:
+                # Как при чтении в текстовом режиме: универсальные переводы строк
+                file_content = data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+                section = render_markdown_section(file_path, file_content).encode('utf-8')
+                write_cached_section(sections_dir, name, section)
+                print(f"Обработан: {file_path}")
+            else:
+                print(f"Из кэша: {file_path}")
+
+            yield section, key, {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                                 'sha256': sha256, 'name': name}
 
         except UnicodeDecodeError:
             print(f"Пропущен: {file_path} (проблемы с кодировкой)")
         except Exception as e:
             print(f"Ошибка при обработке {file_path}: {e}")
 
-    return "\n".join(content_lines)
 
+class SectionCache:
+    """
+    Кэш отформатированных секций Markdown по отдельным файлам.
+    Секции хранятся в файлах, адресуемых хэшем содержимого, индекс связывает
+    путь с mtime, размером и хэшем. При превышении лимита на диске удаляются
+    давно не использованные секции (LRU).
+    """
+    CACHE_VERSION = 1
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.sections_dir = get_cache_dir() / 'sections'
+        self.sections_dir.mkdir(exist_ok=True)
+        self.index_path = get_cache_dir() / 'sections.json'
+        self.entries = {}
+        # Записи, обновленные в этом процессе: их возвращают процессы отдельных корней
+        self.updated = {}
+        # Секции новее загрузки индекса могли добавить параллельные запуски
+        self.loaded_at = time.time()
+        self.load()
+
+    def load(self):
+        """Загружает индекс кэша секций, если он есть и совместим."""
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as index_file:
+                index = json.load(index_file)
+        except (OSError, ValueError):
+            return
+        if index.get('version') == self.CACHE_VERSION:
+            self.entries = index.get('entries', {})
+
+    def iter_sections(self, files, parallel=False):
+        """Генератор секций (в байтах) для списка файлов с обновлением индекса."""
+        items = []
+        for file_path in files:
+            key = str(Path(file_path).resolve())
+            items.append((file_path, key, self.entries.get(key)))
+
+        func = functools.partial(iter_cached_markdown_sections, sections_dir=str(self.sections_dir))
+        for section, key, entry in iter_processed(func, items, parallel):
+            entry['used'] = time.time()
+            self.entries[key] = entry
+            self.updated[key] = entry
+            yield section
+
+    def remove_section(self, name):
+        """Удаляет файл секции; его уже мог удалить параллельный запуск."""
+        try:
+            os.remove(self.sections_dir / name)
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """
+        Удаляет секции без ссылок из индекса и самые старые секции сверх лимита.
+        Учитываются только готовые файлы *.md; временные файлы и секции, появившиеся
+        после загрузки индекса (их могли записать параллельные запуски), не удаляются.
+        """
+        sizes = {}
+        recent = set()
+        for item in os.scandir(self.sections_dir):
+            if item.is_file() and item.name.endswith('.md'):
+                stat = item.stat()
+                sizes[item.name] = stat.st_size
+                if stat.st_mtime >= self.loaded_at:
+                    recent.add(item.name)
+
+        referenced = {entry['name'] for entry in self.entries.values()}
+        for name in list(sizes):
+            if name not in referenced and name not in recent:
+                self.remove_section(name)
+                del sizes[name]
+
+        # Записи без файла секции бесполезны
+        self.entries = {key: entry for key, entry in self.entries.items() if entry['name'] in sizes}
+
+        total = sum(sizes.values())
+        if total <= self.budget_bytes:
+            return
 
-def write_to_markdown(files, base_directory_path, num_parent_dirs):
-    """Записывает содержимое файлов в markdown файл с возможностью использования шаблона."""
-    # Шаг 1: Генерируем содержимое из выбранных файлов
-    print("\nШаг 2: Генерация содержимого из выбранных файлов...")
-    generated_content = generate_markdown_content(files)
+        users = {}
+        for entry in self.entries.values():
+            users[entry['name']] = users.get(entry['name'], 0) + 1
+
+        for key, entry in sorted(self.entries.items(), key=lambda item: item[1]['used']):
+            if total <= self.budget_bytes:
+                break
+            del self.entries[key]
+            users[entry['name']] -= 1
+            if not users[entry['name']]:
+                self.remove_section(entry['name'])
+                total -= sizes.pop(entry['name'])
+
+    def save(self):
+        """Применяет лимит на диске и сохраняет индекс кэша секций."""
+        try:
+            self.evict()
+            index = {'version': self.CACHE_VERSION, 'entries': self.entries}
+            temp_path = self.index_path.with_name(f"sections.{os.getpid()}.tmp")
+            with open(temp_path, 'w', encoding='utf-8') as index_file:
+                json.dump(index, index_file)
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            print(f"Не удалось сохранить кэш секций {self.index_path}: {e}")
 
-    # Шаг 2: Проверяем наличие шаблонов
-    print("\nШаг 3: Проверка доступных шаблонов...")
-    templates = get_markdown_templates()
 
-    final_content = generated_content
-    template_used = None
+def write_markdown_stream(output_file, file_groups, template_path, compression, section_cache=None):
+    """
+    Потоково записывает markdown-документ со сжатием, параллельным чтению файлов.
+    При нескольких корнях файлы читаются и форматируются в процессах.
+    С кэшем секций неизмененные файлы копируются в результат из кэша;
+    индекс кэша сохраняет вызывающий код.
+    """
+    files = [file_path for _, group_files in file_groups for file_path in group_files]
+    parallel = len(file_groups) > 1
+    if section_cache is not None:
+        sections = section_cache.iter_sections(files, parallel)
+    else:
+        sections = iter_processed(iter_markdown_sections, files, parallel)
+    chunks = iter_markdown_chunks(sections, template_path)
+    with open_compressed_output(output_file, compression) as output:
+        for chunk in chunks:
+            output.write(chunk)
+
 
-    if templates:
-        # Предлагаем пользователю выбрать шаблон
-        selected_template = select_template(templates)
+def write_archive(output_file, file_groups, container, compression, num_parent_dirs=1):
+    """
+    Записывает tar или zip архив: одна запись на каждый исходный файл
+    и манифест MANIFEST.json со списком файлов в порядке выбора.
+    Записи каждого корня лежат в каталоге с уникальной меткой корня (get_root_labels).
+    Возвращает количество записанных файлов.
+    """
+    timestamp = datetime.now()
+    labels = get_root_labels([root_path for root_path, _ in file_groups], num_parent_dirs)
+    items = [(file_path, get_archive_member_name(file_path, root_path, label))
+             for (root_path, files), label in zip(file_groups, labels) for file_path in files]
+    entries = iter_processed(iter_archive_entries, items, len(file_groups) > 1)
+    manifest = {
+        'created': timestamp.isoformat(timespec='seconds'),
+        'base_directories': [{'path': str(root_path), 'label': label}
+                             for (root_path, _), label in zip(file_groups, labels)],
+        'files': [],
+    }
 
-        if selected_template:
-            # Применяем выбранный шаблон
-            final_content = apply_template(selected_template, generated_content)
-            template_used = selected_template.name
+    if container == 'zip':
+        with zipfile.ZipFile(output_file, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for name, data, entry in entries:
+                archive.writestr(name, data)
+                manifest['files'].append(entry)
+            archive.writestr(MANIFEST_NAME, json.dumps(manifest, ensure_ascii=False, indent=2))
+        return len(manifest['files'])
+
+    def add_member(archive, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = int(timestamp.timestamp())
+        info.mode = 0o644
+        archive.addfile(info, io.BytesIO(data))
+
+    with open_compressed_output(output_file, compression) as output:
+        # Потоковый режим 'w|' не требует перемещения по выходному файлу
+        with tarfile.open(fileobj=output, mode='w|') as archive:
+            for name, data, entry in entries:
+                add_member(archive, name, data)
+                manifest['files'].append(entry)
+            add_member(archive, MANIFEST_NAME,
+                       json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+    return len(manifest['files'])
+
+
+def write_bundle(output_file, bundle, output_format, template_path, num_parent_dirs, section_cache=None):
+    """
+    Записывает один файл результата для набора групп (корень, файлы).
+    Возвращает количество обработанных файлов и записи кэша секций,
+    обновленные при записи (их объединяет основной процесс).
+    """
+    container, compression = OUTPUT_FORMATS[output_format]
+    if container == 'md':
+        write_markdown_stream(output_file, bundle, template_path, compression, section_cache)
+        processed_count = sum(len(files) for _, files in bundle)
     else:
-        print("Каталог 'promts' не найден или не содержит .md файлов-шаблонов")
-
-    # Шаг 3: Сохраняем результат в файл
-    output_file = generate_output_filename(base_directory_path, num_parent_dirs)
-
-    with open(output_file, 'w', encoding='utf-8') as md_file:
-        md_file.write(final_content)
-
-    # Информируем пользователя о результате
-    print(f"\n{'='*60}")
-    print("РЕЗУЛЬТАТ СОХРАНЕНИЯ:")
-    print(f"{'='*60}")
-    print(f"Файл: {output_file}")
-    print(f"Количество обработанных файлов: {len(files)}")
-    if template_used:
-        print(f"Использован шаблон: {template_used}")
+        processed_count = write_archive(output_file, bundle, container, compression, num_parent_dirs)
+    return processed_count, section_cache.updated if section_cache is not None else {}
+
+
+def write_to_markdown(file_groups, num_parent_dirs, output_format='md', per_root=False, section_cache=None):
+    """
+    Записывает содержимое файлов в markdown файл с возможностью использования шаблона.
+    file_groups - список пар (корень, выбранные файлы). При per_root=True
+    для каждого корня создается отдельный файл, иначе - один общий.
+    section_cache - необязательный SectionCache для повторного использования секций.
+    output_format задает расширение результата (см. OUTPUT_FORMATS): markdown
+    со сжатием gz/xz/zst либо tar/zip архив с отдельной записью на каждый файл.
+    """
+    container, _ = OUTPUT_FORMATS[output_format]
+    template_used = None
+    selected_template = None
+
+    if container == 'md':
+        # Шаг 3: Шаблон выбираем заранее, чтобы записывать результат потоково
+        print("\nШаг 3: Проверка доступных шаблонов...")
+        templates = get_markdown_templates()
+
+        if templates:
+            # Предлагаем пользователю выбрать шаблон
+            selected_template = select_template(templates)
+            if selected_template:
+                template_used = selected_template.name
+        else:
+            print("Каталог 'promts' не найден или не содержит .md файлов-шаблонов")
+
+    # Шаг 4: Генерируем содержимое и одновременно сжимаем и сохраняем его в файл
+    print("\nШаг 4: Генерация содержимого из выбранных файлов...")
+    file_groups = [group for group in file_groups if group[1]]
+    bundles = [[group] for group in file_groups] if per_root else [file_groups]
+    output_files = [generate_output_filename([root_path for root_path, _ in bundle],
+                                             num_parent_dirs, output_format)
+                    for bundle in bundles]
+    jobs = [(output_file, bundle, output_format, selected_template, num_parent_dirs, section_cache)
+            for output_file, bundle in zip(output_files, bundles)]
+
+    if len(jobs) > 1:
+        # Отдельные файлы корней записываются одновременно, по процессу на корень
+        max_workers = min(len(jobs), os.cpu_count() or 1)
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = [future.result() for future in
+                       [executor.submit(write_bundle, *job) for job in jobs]]
     else:
-        print("Использован шаблон: нет (прямое сохранение)")
-    print(f"{'='*60}")
+        results = [write_bundle(*job) for job in jobs]
+
+    for output_file, (processed_count, updated_sections) in zip(output_files, results):
+        if section_cache is not None:
+            section_cache.entries.update(updated_sections)
+
+        # Информируем пользователя о результате
+        print(f"\n{'='*60}")
+        print("РЕЗУЛЬТАТ СОХРАНЕНИЯ:")
+        print(f"{'='*60}")
+        print(f"Файл: {output_file}")
+        print(f"Количество обработанных файлов: {processed_count}")
+        if container != 'md':
+            print(f"Формат: архив {output_format} (манифест: {MANIFEST_NAME})")
+        elif template_used:
+            print(f"Использован шаблон: {template_used}")
+        else:
+            print("Использован шаблон: нет (прямое сохранение)")
+        print(f"{'='*60}")
 
-    # Открываем файл в редакторе
-    open_markdown_file(Path(output_file).resolve())
+    if section_cache is not None:
+        section_cache.save()
+
+    # Открываем файл в редакторе (только несжатый markdown)
+    if output_format == 'md':
+        for output_file in output_files:
+            open_markdown_file(Path(output_file).resolve())
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Сканирует исходные файлы и сохраняет их в markdown файл с интерактивным выбором расширений.')
-    parser.add_argument('directory', help='Путь к каталогу для сканирования')
-    parser.add_argument('num_parents', nargs='?', type=int, default=1,
-                       help='Количество родительских каталогов для включения в имя файла (по умолчанию: 1)')
+    parser = argparse.ArgumentParser(description='Сканирует исходные файлы и сохраняет их в markdown файл с интерактивным выбором расширений.',
+                                     usage='%(prog)s [параметры] directory [directory ...] [num_parents]')
+    # num_parents разбирается вручную: argparse не может отделить необязательное
+    # число от списка каталогов произвольной длины
+    parser.add_argument('directories', nargs='+', metavar='directory [num_parents]',
+                        help='Пути к каталогам для сканирования (можно указать несколько корней). '
+                             'Если аргументов больше одного, последний аргумент-целое число всегда считается '
+                             'num_parents - количеством родительских каталогов для включения в имя файла '
+                             '(по умолчанию: 1). Каталог с числовым именем в конце списка указывайте как ./2')
+    parser.add_argument('-f', '--format', dest='output_format', default='md', choices=list(OUTPUT_FORMATS),
+                        help='Формат результата: markdown (md, md.gz, md.xz, md.zst) '
+                             'или архив с файлом на каждый исходник (tar, tar.gz, tar.xz, tar.zst, zip)')
+    parser.add_argument('--per-root', action='store_true',
+                        help='Создать отдельный файл для каждого корня вместо одного общего')
+    parser.add_argument('-I', '--include-path', dest='include_paths', action='append', default=[],
+                        help='Каталог поиска для #include и import (можно указать несколько раз)')
+    parser.add_argument('--closure', dest='closure_files', action='append', default=[],
+                        help='Выделить файл и все его зависимости #include/import (можно указать несколько раз)')
+    parser.add_argument('--search', dest='search_texts', action='append', default=[],
+                        help='Выделить файлы, содержащие указанный текст (можно указать несколько раз)')
+    parser.add_argument('--search-index', action='store_true',
+                        help='Использовать постоянный триграммный индекс для поиска по содержимому')
+    parser.add_argument('--section-cache', action='store_true',
+                        help='Кэшировать секции markdown по файлам и копировать неизмененные из кэша')
+    parser.add_argument('--section-cache-size', type=int, default=512, metavar='MB',
+                        help='Лимит размера кэша секций на диске в мегабайтах (по умолчанию: 512)')
     args = parser.parse_args()
 
-    directory_path = args.directory
-    num_parent_dirs = args.num_parents
+    directory_paths = args.directories
+    num_parent_dirs = 1
+
+    # Последний позиционный аргумент-число - количество родительских каталогов,
+    # независимо от того, существует ли каталог с таким именем
+    if len(directory_paths) > 1:
+        try:
+            num_parent_dirs = int(directory_paths[-1])
+            directory_paths = directory_paths[:-1]
+        except ValueError:
+            pass
+
+    for directory_path in directory_paths:
+        if not Path(directory_path).is_dir():
+            print(f"Ошибка: Каталог '{directory_path}' не существует.")
+            sys.exit(1)
+
+    for closure_file in args.closure_files:
+        if not Path(closure_file).is_file():
+            print(f"Ошибка: файл '{closure_file}' не существует.")
+            sys.exit(1)
 
     if num_parent_dirs < 0:
         print("Количество родительских каталогов не может быть отрицательным.")
         sys.exit(1)
 
+    if OUTPUT_FORMATS[args.output_format][1] == 'zst' and zstandard is None:
+        print("Для формата .zst необходим пакет 'zstandard' (pip install zstandard).")
+        sys.exit(1)
+
     default_extensions = {'.cpp', '.cxx', '.c++', '.cc', '.mm', '.c', '.h',
                          '.hh', '.hpp', '.qml', '.txt'}
 
-    file_tree = FileTree(directory_path, default_extensions)
+    file_tree = FileTree(directory_paths, default_extensions, args.include_paths, args.search_index)
+
+    if args.closure_files:
+        file_tree.select_dependency_closure(args.closure_files)
+
+    for search_text in args.search_texts:
+        file_tree.select_matching_files(search_text)
 
     file_tree.print_tree()
 
@@ -733,6 +2003,8 @@ def main():
     print("- Введите '-номер*' (например, '-9*'): снять выделение рекурсивно")
     print("- Введите 'номер-расширение' (например, '1-1'): инвертировать файлы с указанным расширением")
     print("- Введите 'номер-расширение*' (например, '1-1*'): инвертировать файлы с указанным расширением рекурсивно")
+    print("- Введите '@номер' (например, '@5'): выделить файл (или файлы каталога) и все их зависимости #include/import")
+    print("- Введите '/текст' (например, '/ConnectionPool'): выделить все файлы, содержащие текст")
     print("- Можно указать несколько команд через пробел")
     print("- Нажмите Enter без ввода для перехода ко второму этапу\n")
 
@@ -756,15 +2028,18 @@ def main():
             break
 
     print("\nШаг 2: Сбор выбранных файлов...")
-    selected_files = file_tree.root.get_selected_files()
+    file_groups = file_tree.get_selected_file_groups()
+    selected_count = sum(len(files) for _, files in file_groups)
 
-    if not selected_files:
+    if not selected_count:
         print("Не выбрано ни одного файла. Выход.")
         sys.exit(0)
 
-    print(f"Найдено файлов для обработки: {len(selected_files)}")
+    print(f"Найдено файлов для обработки: {selected_count}")
+
+    section_cache = SectionCache(args.section_cache_size * 1024 * 1024) if args.section_cache else None
 
-    write_to_markdown(selected_files, directory_path, num_parent_dirs)
+    write_to_markdown(file_groups, num_parent_dirs, args.output_format, args.per_root, section_cache)
 
 
 if __name__ == "__main__":